@@ -1,48 +1,59 @@
-import json
+import aiofiles
+import orjson
 import asyncio
 from typing import List
 
-from main import recommend_assessments_raw
+import numpy as np
+
+from main import recommend_assessments_batch
 
 TRAIN_FILE = "train.json"   # labeled train set
 K = 10
 
 
+# Bound once so the per-URL comprehensions skip attribute lookups
+_rstrip = str.rstrip
+_lower = str.lower
+
+
 def normalize(urls: List[str]) -> List[str]:
     """Normalize URLs for fair comparison"""
-    return [u.rstrip("/").lower() for u in urls]
+    return [_lower(_rstrip(u, "/")) for u in urls]
 
 
-def recall_at_k(predicted_urls: List[str], relevant_urls: List[str], k: int) -> float:
-    predicted_top_k = predicted_urls[:k]
-    if not relevant_urls:
+def recall_at_k(predicted_urls: List[str], relevant_urls: np.ndarray, k: int) -> float:
+    """Fraction of the (unique) relevant URLs found in the top-k predictions."""
+    if not relevant_urls.size:
         return 0.0
-    hits = len(set(predicted_top_k) & set(relevant_urls))
-    return hits / len(relevant_urls)
+    hits = np.isin(relevant_urls, predicted_urls[:k]).sum()
+    return float(hits) / relevant_urls.size
 
 
 async def evaluate():
-    with open(TRAIN_FILE, "r", encoding="utf-8") as f:
-        train_data = json.load(f)
-
-    recalls = []
+    async with aiofiles.open(TRAIN_FILE, "rb") as f:
+        train_data = orjson.loads(await f.read())
 
+    # ✅ CORRECT KEY — normalized once per item, deduplicated for np.isin
     for item in train_data:
-        query = item["query"]
+        item["_rel_norm"] = np.unique(normalize(item["relevant_urls"]))
 
-        # ✅ CORRECT KEY
-        relevant_urls = normalize(item["relevant_urls"])
+    queries = [item["query"] for item in train_data]
 
-        # ✅ PURE VECTOR RETRIEVAL (NO LLM)
-        try:
-            recommendations = await recommend_assessments_raw(query)
-        except RuntimeError as e:
-            print(f"Runtime error while retrieving vectors: {e}")
-            return 0.0
+    # ✅ PURE VECTOR RETRIEVAL (NO LLM), all queries embedded in one call
+    try:
+        all_recs = await recommend_assessments_batch(queries, raw=True)
+    except RuntimeError as e:
+        print(f"Runtime error while retrieving vectors: {e}")
+        return 0.0
+
+    recalls = []
+
+    for item, recommendations in zip(train_data, all_recs):
+        query = item["query"]
 
-        predicted_urls = normalize([r["url"] for r in recommendations])
+        predicted_urls = [_lower(_rstrip(r["url"], "/")) for r in recommendations]
 
-        r = recall_at_k(predicted_urls, relevant_urls, K)
+        r = recall_at_k(predicted_urls, item["_rel_norm"], K)
         recalls.append(r)
 
         print(f"\nQuery: {query}")
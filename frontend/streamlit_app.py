@@ -1,9 +1,59 @@
+import io
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
-from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser
 import os
 
+# Cap on bytes read from a job-description page so huge pages can't stall the UI
+MAX_PAGE_BYTES = 2_000_000
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """One keep-alive connection pool shared across reruns and sessions (skips repeated TCP/TLS handshakes)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_job_text(url: str) -> str:
+    """Fetch a job posting and return its visible text (cached so reruns don't refetch)."""
+    with get_session().get(url, timeout=30, stream=True) as page:
+        page.raise_for_status()
+        content = page.raw.read(MAX_PAGE_BYTES, decode_content=True)
+    tree = HTMLParser(content)
+    tree.strip_tags(["script", "style"])
+    body = tree.body or tree.root
+    return body.text(separator=' ').strip()
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_recommendations(recommend_endpoint: str, job_description: str) -> dict:
+    """POST to the backend and return its JSON; errors raise and are therefore never cached."""
+    response = get_session().post(
+        recommend_endpoint,
+        json={"job_description": job_description},
+        timeout=300  # 2 minute timeout since LLM processing can take time
+    )
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(response.text, response=response)
+    return response.json()
+
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Encode the table as CSV straight into a byte buffer (cached on the DataFrame's hash)."""
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding='utf-8')
+    return buf.getvalue()
+
+
 st.title("SHL Assessment Recommender")
 
 st.write("Enter a job description or provide a URL to get the most relevant SHL assessments.")
@@ -21,10 +71,7 @@ with url_tab:
     url = st.text_input("Job Description URL:")
     if url:
         try:
-            page = requests.get(url, timeout=30)
-            page.raise_for_status()
-            soup = BeautifulSoup(page.content, 'html.parser')
-            job_description = soup.get_text().strip()  # Directly use the parsed job description
+            job_description = fetch_job_text(url)  # Directly use the parsed job description
         except requests.exceptions.RequestException as e:
             st.error(f"Failed to fetch the URL provided: {e}")
         except Exception as e:
@@ -46,77 +93,58 @@ if st.button("Get Recommendations", disabled=(backend_url is None)):
             recommend_endpoint = f"{backend_url}/recommend"
 
             try:
-                # Add timeout to prevent hanging
-                response = requests.post(
-                    recommend_endpoint,
-                    json={"job_description": job_description},
-                    timeout=300  # 2 minute timeout since LLM processing can take time
-                )
-
-                # Raise for non-2xx responses to handle gracefully
-                if response.status_code != 200:
-                    # Try to extract message from response
-                    try:
-                        err = response.json().get('detail') or response.text
-                    except Exception:
-                        err = response.text
-                    st.error(f"Error from recommendation service: \n{response.text}")
+                try:
+                    response_json = get_recommendations(recommend_endpoint, job_description)
+                except ValueError:
+                    st.error("Invalid response from recommendation service. Please try again later.")
+                    response_json = {}
+
+                # API returns 'recommended_assessments' per spec
+                recommendations = response_json.get("recommended_assessments", [])
+
+                if recommendations:
+                    st.success(f"Found {len(recommendations)} relevant SHL assessments!")
+
+                    # Convert to DataFrame for display
+                    df = pd.DataFrame(recommendations)
+
+                    # Assign correct column names to match backend schema
+                    df = df.rename(columns={
+                        "name": "Assessment Name",
+                        "url": "URL",
+                        "remote_support": "Remote Support",
+                        "adaptive_support": "Adaptive/IRT Support",
+                        "duration": "Duration (mins)",
+                        "test_type": "Test Types"
+                    })
+
+                    # Format test_type as comma-separated string if it's a list
+                    if 'Test Types' in df.columns:
+                        df['Test Types'] = df['Test Types'].apply(lambda x: ', '.join(x) if isinstance(x, list) else x)
+
+                    # Ensure duration is an integer column
+                    if 'Duration (mins)' in df.columns:
+                        df['Duration (mins)'] = df['Duration (mins)'].fillna(0).astype(int)
+
+                    # Display the recommendations in a table; URLs render as clickable links in the grid
+                    st.dataframe(
+                        df.reset_index(drop=True),
+                        use_container_width=True,
+                        column_config={"URL": st.column_config.LinkColumn("URL")},
+                    )
+
+                    # Add a download button for CSV export
+                    st.download_button(
+                        label="Download recommendations as CSV",
+                        data=to_csv_bytes(df),
+                        file_name="shl_recommendations.csv",
+                        mime="text/csv",
+                    )
                 else:
-                    try:
-                        response_json = response.json()
-                    except ValueError:
-                        st.error("Invalid response from recommendation service. Please try again later.")
-                        response_json = {}
-
-                    # API returns 'recommended_assessments' per spec
-                    recommendations = response_json.get("recommended_assessments", [])
-
-                    if recommendations:
-                        st.success(f"Found {len(recommendations)} relevant SHL assessments!")
-
-                        # Convert to DataFrame for display
-                        df = pd.DataFrame(recommendations)
-
-                        # Assign correct column names to match backend schema
-                        df = df.rename(columns={
-                            "name": "Assessment Name",
-                            "url": "URL",
-                            "remote_support": "Remote Support",
-                            "adaptive_support": "Adaptive/IRT Support",
-                            "duration": "Duration (mins)",
-                            "test_type": "Test Types"
-                        })
-
-                        # Format test_type as comma-separated string if it's a list
-                        if 'Test Types' in df.columns:
-                            df['Test Types'] = df['Test Types'].apply(lambda x: ', '.join(x) if isinstance(x, list) else x)
-
-                        # Ensure duration is an integer column
-                        if 'Duration (mins)' in df.columns:
-                            df['Duration (mins)'] = df['Duration (mins)'].fillna(0).astype(int)
-
-                        # Display the recommendations in a table
-                        st.dataframe(df.reset_index(drop=True))
-
-                        # Provide click-through links below the table (clean, accessible)
-                        if 'URL' in df.columns:
-                            st.markdown("**Assessment links:**")
-                            for idx, row in df.iterrows():
-                                url_link = row.get('URL')
-                                name = row.get('Assessment Name') or url_link
-                                if url_link:
-                                    st.markdown(f"- [{name}]({url_link})")
-
-                        # Add a download button for CSV export
-                        csv = df.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label="Download recommendations as CSV",
-                            data=csv,
-                            file_name="shl_recommendations.csv",
-                            mime="text/csv",
-                        )
-                    else:
-                        st.warning("No matching assessments found for this job description. Try providing more details about the role and required skills.")
+                    st.warning("No matching assessments found for this job description. Try providing more details about the role and required skills.")
+            except requests.exceptions.HTTPError as e:
+                # Non-200 from the backend: show its message
+                st.error(f"Error from recommendation service: \n{e.response.text}")
             except requests.exceptions.ConnectionError:
                 st.error(f"Connection error: Could not reach the recommendation service at {backend_url}. Please ensure the BACKEND_API_URL is correct and the backend is running.")
             except requests.exceptions.Timeout:
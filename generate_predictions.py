@@ -1,58 +1,65 @@
 # generate_predictions.py
 import csv
-import json
+import aiofiles
+import orjson
+import os
 import asyncio
-from main import recommend_assessments
+from contextlib import aclosing
+from main import iter_recommendations_batch
 
 TEST_FILE = "test.json"              # unlabeled test set
 OUTPUT_FILE = "test_predictions.csv"
 
 
 async def generate():
-    with open(TEST_FILE, "r", encoding="utf-8") as f:
-        test_queries = json.load(f)
-
-    rows = []
-
-    for item in test_queries:
-        query = item["query"]
-
-        try:
-            recommendations = await recommend_assessments(query)
-        except RuntimeError as e:
-            raise RuntimeError(f"Runtime error while generating recommendations: {e}")
-
-        # Extract URLs, remove empties, preserve order, and deduplicate per query
-        seen = set()
-        unique_urls = []
-        for rec in recommendations:
-            url = rec.get("url")
-            if not url or not str(url).strip():
-                continue
-            u = str(url).strip()
-            if u not in seen:
-                seen.add(u)
-                unique_urls.append(u)
-
-        # Enforce 5-10 URLs per query
-        if len(unique_urls) < 5:
-            raise AssertionError(f"Less than 5 unique recommendations for query: '{query}' (found {len(unique_urls)})")
-        if len(unique_urls) > 10:
-            # Trim to 10 but raise loudly so user knows
-            raise AssertionError(f"More than 10 recommendations for query: '{query}' (found {len(unique_urls)})")
-
-        # Add rows for this query (one row per URL)
-        for url in unique_urls:
-            rows.append({"Query": query, "Assessment_url": url})
-
-    # Final check: no empty rows and header correctness
-    if not rows:
-        raise AssertionError("No prediction rows to write")
-
-    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["Query", "Assessment_url"])
-        writer.writeheader()
-        writer.writerows(rows)
+    async with aiofiles.open(TEST_FILE, "rb") as f:
+        test_queries = orjson.loads(await f.read())
+
+    queries = [item["query"] for item in test_queries]
+
+    # Stream rows to a temp file as each query resolves (flushed in input order); it only
+    # replaces OUTPUT_FILE once every query passed, so a failed run never leaves a partial CSV.
+    tmp_file = OUTPUT_FILE + ".tmp"
+    n_rows = 0
+    try:
+        with open(tmp_file, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Query", "Assessment_url"])
+
+            # aclosing: a failed query cancels the searches still in flight
+            async with aclosing(iter_recommendations_batch(queries)) as results:
+                try:
+                    i = 0
+                    async for recommendations in results:
+                        query = queries[i]
+                        i += 1
+
+                        # Extract URLs, remove empties, preserve order, and deduplicate per query
+                        unique_urls = list(dict.fromkeys(
+                            u for u in (str(rec.get("url") or "").strip() for rec in recommendations) if u
+                        ))
+
+                        # Enforce 5-10 URLs per query
+                        if len(unique_urls) < 5:
+                            raise AssertionError(f"Less than 5 unique recommendations for query: '{query}' (found {len(unique_urls)})")
+                        if len(unique_urls) > 10:
+                            # Trim to 10 but raise loudly so user knows
+                            raise AssertionError(f"More than 10 recommendations for query: '{query}' (found {len(unique_urls)})")
+
+                        # Write rows for this query (one row per URL)
+                        writer.writerows((query, url) for url in unique_urls)
+                        n_rows += len(unique_urls)
+                except RuntimeError as e:
+                    raise RuntimeError(f"Runtime error while generating recommendations: {e}")
+
+        # Final check: no empty rows and header correctness
+        if not n_rows:
+            raise AssertionError("No prediction rows to write")
+
+        os.replace(tmp_file, OUTPUT_FILE)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
     print(f"Saved predictions to {OUTPUT_FILE}")
 
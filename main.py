@@ -1,15 +1,41 @@
 import asyncio
+import functools
+import hashlib
 import json
+import logging
+import mmap
 import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
 from typing import Any, Dict, List
 
+import numpy as np
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is the fallback
+    orjson = None
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    HnswConfigDiff,
+    MatchValue,
+    PayloadSchemaType,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
 
 from langchain_core.documents import Document
-from langchain.prompts import PromptTemplate
-from langchain_qdrant import QdrantVectorStore
 # SentenceTransformerEmbeddings will be imported lazily in get_embedding_model() to avoid import-time dependency failures
 from langchain_openai import ChatOpenAI
 
@@ -22,23 +48,120 @@ load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Optional: enables the semantic response cache (needs Redis Stack / RediSearch)
+REDIS_URL = os.getenv("REDIS_URL")
 
 SHL_FILE = "shl_assessments.json"
 COLLECTION_NAME = "shl_assessments"
 
+logger = logging.getLogger(__name__)
+
 # --------------------------------------------------
 # LOCAL EMBEDDINGS (FREE, STABLE)
 # --------------------------------------------------
 # Lazy initialization of SentenceTransformerEmbeddings to avoid import-time dependency issues
 _embedding_model = None
+# Warmup loads the model from several threads at once; only one of them may build it
+_embedding_lock = threading.Lock()
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+
+# int8 ONNX export of all-MiniLM-L6-v2 (see scripts/export_minilm.py); used when present
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "models/all-MiniLM-L6-v2-onnx-int8")
+ONNX_MAX_SEQ_LENGTH = 256  # same truncation as the sentence-transformers model
+# "cuda" serves sentence-transformers on the GPU even when the ONNX export exists;
+# otherwise torch is only imported (and CUDA probed) when there is no ONNX export
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "").strip().lower()
+
+
+class OnnxMiniLMEmbeddings:
+    """all-MiniLM-L6-v2 on ONNX Runtime: mean pooling + L2 norm, same interface as the langchain embeddings."""
+
+    def __init__(self, model_dir: str, batch_size: int = 64):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model_quantized.onnx"),
+            sess_options=opts,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+        m = mask[..., None].astype(np.float32)
+        pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+        """Embed texts in length-sorted batches (less padding) and return them in input order."""
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+        order = np.argsort([len(t) for t in texts])
+        out = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            out[idx] = self._encode_batch([texts[i] for i in idx])
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+def _cuda_available() -> bool:
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
 
 def get_embedding_model():
-    """Return a cached SentenceTransformerEmbeddings instance (model: all-MiniLM-L6-v2)."""
+    """Return a cached embedding model for all-MiniLM-L6-v2.
+
+    The ONNX int8 export when available (unless EMBEDDING_DEVICE=cuda), otherwise
+    SentenceTransformers, in fp16 on CUDA when a GPU is present.
+    """
     global _embedding_model
-    if _embedding_model is None:
+    if _embedding_model is not None:
+        return _embedding_model
+    with _embedding_lock:
+        if _embedding_model is not None:
+            return _embedding_model
+        # Checked before any torch import: the ONNX path never loads torch
+        if EMBEDDING_DEVICE != "cuda" and os.path.isfile(os.path.join(ONNX_MODEL_DIR, "model_quantized.onnx")):
+            try:
+                _embedding_model = OnnxMiniLMEmbeddings(ONNX_MODEL_DIR)
+                return _embedding_model
+            except ImportError as e:
+                logger.warning("ONNX model found but onnxruntime/tokenizers unavailable, using sentence-transformers: %s", e)
+        use_cuda = EMBEDDING_DEVICE != "cpu" and _cuda_available()
         try:
             from langchain_community.embeddings import SentenceTransformerEmbeddings as _STE
-            _embedding_model = _STE(model_name="all-MiniLM-L6-v2")
+            _embedding_model = _STE(
+                model_name="all-MiniLM-L6-v2",
+                model_kwargs={"device": "cuda" if use_cuda else "cpu"},
+            )
+            if use_cuda:
+                _embedding_model.client.half()
         except ImportError as e:
             # Provide a clear actionable error message for common version mismatch issues
             raise RuntimeError(
@@ -50,28 +173,121 @@ def get_embedding_model():
                 "After reinstalling, retry running the script."
                 f"\nOriginal import error: {e}"
             ) from e
-    return _embedding_model
+        return _embedding_model
+
+INGEST_BATCH_SIZE = 64
+INGEST_BATCH_SIZE_GPU = 256
+
+def _encode_documents(texts: List[str]) -> np.ndarray:
+    """Embed ingest texts with one encode call, bypassing langchain's wrapper.
+
+    Both backends sort the inputs by length before batching (and restore the
+    original order), so each batch pads to similar lengths.
+    """
+    model = get_embedding_model()
+    if isinstance(model, OnnxMiniLMEmbeddings):
+        return model.encode(texts, batch_size=INGEST_BATCH_SIZE)
+
+    st_model = model.client
+    if st_model.device.type == "cuda":
+        import torch
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16):
+            vectors = st_model.encode(
+                texts,
+                batch_size=INGEST_BATCH_SIZE_GPU,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+        # fp16 model output; Qdrant stores float32
+        return vectors.astype(np.float32)
+
+    return st_model.encode(
+        texts,
+        batch_size=INGEST_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+
+# --------------------------------------------------
+# QUERY EMBEDDING MICRO-BATCHING
+# --------------------------------------------------
+# Concurrent requests are coalesced: the batcher waits up to EMBED_BATCH_WINDOW
+# seconds (or until EMBED_MAX_BATCH queries are queued) and embeds them all
+# in one forward pass instead of one model call per request.
+EMBED_MAX_BATCH = 32
+EMBED_BATCH_WINDOW = 0.015
+
+class _EmbeddingBatcher:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            items = [await self.queue.get()]
+            deadline = self.loop.time() + EMBED_BATCH_WINDOW
+            while len(items) < EMBED_MAX_BATCH:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                embeddings = await asyncio.to_thread(
+                    get_embedding_model().embed_documents, [text for text, _ in items]
+                )
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for (_, fut), emb in zip(items, embeddings):
+                if not fut.done():
+                    fut.set_result(emb)
+
+    async def embed(self, text: str) -> List[float]:
+        fut = self.loop.create_future()
+        await self.queue.put((text, fut))
+        return await fut
+
+
+_batcher = None
+
+async def embed_query(text: str) -> List[float]:
+    """Embed a single query through the shared micro-batcher of the running event loop."""
+    global _batcher
+    if _batcher is None or _batcher.loop is not asyncio.get_running_loop():
+        _batcher = _EmbeddingBatcher()
+    return await _batcher.embed(text)
 
 # --------------------------------------------------
 # LOAD SHL DATA
 # --------------------------------------------------
-with open(SHL_FILE, "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-# Ensure 'solution_type' is present for all entries (default to 'individual') and persist back
-_updated = False
-for entry in data:
-    if 'solution_type' not in entry:
-        entry['solution_type'] = 'individual'
-        _updated = True
-
-if _updated:
-    with open(SHL_FILE, 'w', encoding='utf-8') as wf:
-        json.dump(data, wf, indent=2, ensure_ascii=False)
-
-documents = []
-for entry in data:
-    content = f"""
+if orjson is not None:
+    # Parse straight from the mapped file pages: no Python-level read/decode of the whole file
+    with open(SHL_FILE, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as buf:
+            data = orjson.loads(buf)
+else:
+    with open(SHL_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+# Every entry is expected to carry 'solution_type' (back-filled once by
+# scripts/migrate_solution_type.py). The Qdrant filter drops points without it,
+# so the ingest payload in get_retriever() defaults it to 'individual' as well.
+assert all("solution_type" in e for e in data), "run scripts/migrate_solution_type.py"
+
+def _iter_documents():
+    """Yield one Document per catalogue entry; only the cold-start ingest in get_retriever() needs them."""
+    for entry in data:
+        content = f"""
     Name: {entry.get('name', '')}
     Description: {entry.get('description', '')}
     Test Types: {', '.join(entry.get('test_types', []))}
@@ -79,68 +295,175 @@ for entry in data:
     Remote Support: {entry.get('remote_testing_support', '')}
     Adaptive Support: {entry.get('adaptive_irt_support', '')}
     """
-    documents.append(Document(page_content=content, metadata=entry))
+        yield Document(page_content=content, metadata=entry)
 
 # --------------------------------------------------
 # LAZY QDRANT INITIALIZATION  ✅ FIX
 # --------------------------------------------------
+# Retrieve a larger candidate pool (k=20) so downstream reranker can pick 5-10
+RETRIEVAL_K = 20
+
+# HNSW graph + int8 scalar quantization kept in RAM: each hop reads 1 byte per dim
+# instead of 4; the top candidates are rescored with the original fp32 vectors.
+HNSW_CONFIG = HnswConfigDiff(m=16, ef_construct=128)
+QUANTIZATION_CONFIG = ScalarQuantization(
+    scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+)
+SEARCH_PARAMS = SearchParams(
+    hnsw_ef=64,
+    quantization=QuantizationSearchParams(rescore=True, oversampling=2.0),
+)
+
+# Only individual solutions are recommended; filtered inside the HNSW search via a keyword payload index
+SOLUTION_TYPE_KEY = "metadata.solution_type"
+INDIVIDUAL_FILTER = Filter(must=[FieldCondition(key=SOLUTION_TYPE_KEY, match=MatchValue(value="individual"))])
+
 _retriever = None
+_retriever_lock = threading.Lock()
 
 def get_retriever():
+    """Return the cached AsyncQdrantClient (gRPC) used for searches.
+
+    The first call also creates/populates the collection and its payload index
+    through a short-lived synchronous REST client, so run it off the event loop.
+    """
     global _retriever
 
     if _retriever is not None:
         return _retriever
 
-    # Initialize Qdrant client lazily and fail at runtime if not configured
-    if not QDRANT_URL or not QDRANT_API_KEY:
-        raise RuntimeError("QDRANT_URL and QDRANT_API_KEY must be set to use the vector store")
+    # Concurrent cold-start searches each call this from their own thread: only one may
+    # create/populate the collection and open the client
+    with _retriever_lock:
+        if _retriever is not None:
+            return _retriever
 
-    client = QdrantClient(
-        url=QDRANT_URL,
-        api_key=QDRANT_API_KEY,
-        timeout=60,
-    )
+        # Initialize Qdrant client lazily and fail at runtime if not configured
+        if not QDRANT_URL or not QDRANT_API_KEY:
+            raise RuntimeError("QDRANT_URL and QDRANT_API_KEY must be set to use the vector store")
 
-    try:
-        client.get_collection(COLLECTION_NAME)
-        vectorstore = QdrantVectorStore(
-            client=client,
+        client = QdrantClient(
+            url=QDRANT_URL,
+            api_key=QDRANT_API_KEY,
+            timeout=60,
+        )
+
+        try:
+            info = client.get_collection(COLLECTION_NAME)
+            if info.config.quantization_config is None:
+                # Collection predates the tuned config: quantize it in place (Qdrant rebuilds in the background)
+                client.update_collection(
+                    collection_name=COLLECTION_NAME,
+                    hnsw_config=HNSW_CONFIG,
+                    quantization_config=QUANTIZATION_CONFIG,
+                )
+        except UnexpectedResponse:
+            client.create_collection(
+                collection_name=COLLECTION_NAME,
+                vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE, on_disk=False),
+                hnsw_config=HNSW_CONFIG,
+                quantization_config=QUANTIZATION_CONFIG,
+            )
+            documents = list(_iter_documents())
+            client.upload_collection(
+                collection_name=COLLECTION_NAME,
+                vectors=_encode_documents([d.page_content for d in documents]),
+                # Same payload layout langchain's QdrantVectorStore uses, so older collections stay compatible
+                # solution_type defaults to 'individual' so INDIVIDUAL_FILTER never drops unmigrated entries
+                payload=[
+                    {
+                        "page_content": d.page_content,
+                        "metadata": {"solution_type": "individual", **d.metadata, "_api": _api_record(d.metadata)},
+                    }
+                    for d in documents
+                ],
+                ids=list(range(len(documents))),
+                batch_size=256,
+            )
+
+        # Idempotent: a no-op when the index already exists
+        client.create_payload_index(
             collection_name=COLLECTION_NAME,
-            embedding=get_embedding_model(),
+            field_name=SOLUTION_TYPE_KEY,
+            field_schema=PayloadSchemaType.KEYWORD,
         )
-    except UnexpectedResponse:
-        vectorstore = QdrantVectorStore.from_documents(
-            documents=documents,
-            embedding=get_embedding_model(),
+
+        client.close()
+
+        # gRPC (HTTP/2, persistent multiplexed channel) for the per-request searches
+        _retriever = AsyncQdrantClient(
             url=QDRANT_URL,
             api_key=QDRANT_API_KEY,
-            collection_name=COLLECTION_NAME,
+            prefer_grpc=True,
+            timeout=60,
         )
+        return _retriever
+
 
-    # Retrieve a larger candidate pool (k=20) so downstream reranker can pick 5-10
-    _retriever = vectorstore.as_retriever(search_kwargs={"k": 20})
-    return _retriever
+async def retrieve(query_vector, k: int = RETRIEVAL_K) -> List[Dict[str, Any]]:
+    """Dense top-k search over individual solutions via query_points; returns the stored metadata dicts."""
+    client = _retriever or await asyncio.to_thread(get_retriever)
+    res = await client.query_points(
+        collection_name=COLLECTION_NAME,
+        query=np.asarray(query_vector, dtype=np.float32).tolist(),
+        limit=k,
+        query_filter=INDIVIDUAL_FILTER,
+        search_params=SEARCH_PARAMS,
+        with_payload=True,
+    )
+    # Payload layout: {"page_content": ..., "metadata": {...}}
+    docs = []
+    for p in res.points:
+        meta = (p.payload or {}).get("metadata", {})
+        # Exact cosine (quantized candidates are rescored), used to gate the LLM rerank
+        meta["_score"] = p.score
+        docs.append(meta)
+    return docs
 
 # --------------------------------------------------
 # RAW RETRIEVAL (NO LLM) — FOR EVALUATION
 # --------------------------------------------------
+def _raw_urls(docs, k: int) -> List[Dict[str, str]]:
+    return [
+        {"url": doc.get("url", "").rstrip("/").lower()}
+        for doc in docs[:k]
+    ]
+
+
+# Candidate lists per query string, shared by the raw (eval) and reranked paths so
+# a harness calling both for the same query pays for one vector search
+CANDIDATE_CACHE_MAX_ENTRIES = 4096
+CANDIDATE_CACHE_TTL = 3600
+_candidate_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+async def _retrieve_candidates(job_description: str, query_vector=None, k: int = RETRIEVAL_K) -> List[Dict[str, Any]]:
+    """Top-k candidates for a query (embedded via the micro-batcher unless a vector is given); cached by query."""
+    key = (job_description, k)
+    now = time.monotonic()
+    hit = _candidate_cache.get(key)
+    if hit is not None and hit[0] > now:
+        _candidate_cache.move_to_end(key)
+        # Copy so callers can't mutate the cached list
+        return list(hit[1])
+
+    if query_vector is None:
+        query_vector = await embed_query(job_description)
+    docs = await retrieve(query_vector, k=k)
+
+    _candidate_cache[key] = (now + CANDIDATE_CACHE_TTL, docs)
+    _candidate_cache.move_to_end(key)
+    if len(_candidate_cache) > CANDIDATE_CACHE_MAX_ENTRIES:
+        _candidate_cache.popitem(last=False)
+    return list(docs)
+
+
 async def recommend_assessments_raw(job_description: str, k: int = 10):
     """
     Pure vector retrieval.
     Used ONLY for Recall@10 evaluation.
     """
-    retriever = get_retriever()
-    docs = await retriever.ainvoke(job_description)
-    # Filter to individual solutions only (treat missing field as individual)
-    filtered = [d for d in docs if d.metadata.get('solution_type', 'individual') == 'individual']
-    if not filtered:
-        filtered = docs
-
-    return [
-        {"url": doc.metadata.get("url", "").rstrip("/").lower()}
-        for doc in filtered[:k]
-    ]
+    docs = await _retrieve_candidates(job_description)
+    return _raw_urls(docs, k)
 
 # --------------------------------------------------
 # GROQ LLM (RERANKING ONLY)
@@ -160,6 +483,8 @@ def get_llm():
         base_url="https://api.groq.com/openai/v1",
         model="llama-3.1-8b-instant",
         temperature=0,
+        # JSON mode: the reply is constrained to a valid JSON object ({"indices": [...]})
+        model_kwargs={"response_format": {"type": "json_object"}},
     )
 
     return _llm
@@ -167,62 +492,274 @@ def get_llm():
 # --------------------------------------------------
 # RERANK PROMPT
 # --------------------------------------------------
-rerank_prompt = PromptTemplate.from_template("""
+_PROMPT_HEADER = """
 You are selecting the most relevant SHL assessments.
 
 Job requirement:
 {query}
 
 Assessments:
-{assessments}
-
-Return ONLY a JSON array of indices (1-based).
+"""
+
+_PROMPT_BLOCK = """
+Assessment {i}:
+Name: {name}
+Description: {description}
+Test Types: {test_types}
+Duration: {duration}
+"""
+
+_PROMPT_FOOTER = """
+Return ONLY a JSON object with the chosen indices (1-based), most relevant first.
 Maximum 10.
 
 Example:
-[1, 3, 5]
-""")
+{"indices": [1, 3, 5]}
+"""
+
+
+def build_rerank_prompt(query: str, docs) -> str:
+    """Render the rerank prompt in a single join over the candidate blocks."""
+    parts = [_PROMPT_HEADER.format(query=query)]
+    parts.extend(
+        _PROMPT_BLOCK.format(
+            i=i,
+            name=doc.get('name'),
+            description=doc.get('description'),
+            test_types=doc.get('test_types'),
+            duration=doc.get('duration'),
+        )
+        for i, doc in enumerate(docs, start=1)
+    )
+    parts.append(_PROMPT_FOOTER)
+    return "".join(parts)
+
+# --------------------------------------------------
+# SEMANTIC CACHE (IN-PROCESS + OPTIONAL REDIS)
+# --------------------------------------------------
+# Near-duplicate job descriptions (cosine >= threshold) reuse a previous response,
+# skipping retrieval and the LLM rerank. Every worker keeps a small in-process
+# cache; when REDIS_URL is set, a shared Redis cache sits behind it.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024"))
+SEMANTIC_CACHE_INDEX = "shl_recommend_cache"
+SEMANTIC_CACHE_PREFIX = "shl_recommend_cache:"
+
+
+class _LocalSemanticCache:
+    """Fixed-size (unit vector -> response) store; expired slots are reused first, then the LRU one."""
+
+    def __init__(self, max_entries: int, ttl: float, dim: int = EMBEDDING_DIM):
+        self.ttl = ttl
+        self.vecs = np.zeros((max_entries, dim), dtype=np.float32)
+        self.expires_at = np.zeros(max_entries)  # 0 marks an empty slot
+        self.last_used = np.zeros(max_entries)
+        self.values: List[Any] = [None] * max_entries
+
+    def lookup(self, vec: np.ndarray):
+        now = time.monotonic()
+        sims = self.vecs @ vec
+        sims[self.expires_at <= now] = -np.inf
+        i = int(np.argmax(sims))
+        if sims[i] < SEMANTIC_CACHE_THRESHOLD:
+            return None
+        self.last_used[i] = now
+        return self.values[i]
+
+    def add(self, vec: np.ndarray, value) -> None:
+        now = time.monotonic()
+        i = int(np.argmin(self.expires_at))
+        if self.expires_at[i] > now:
+            i = int(np.argmin(self.last_used))
+        self.vecs[i] = vec
+        self.values[i] = value
+        self.expires_at[i] = now + self.ttl
+        self.last_used[i] = now
+
+
+_local_cache = _LocalSemanticCache(SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL)
+
+# Exact-match layer in front of the semantic one: identical (canonicalized) strings
+# from retries / duplicate submits / eval reruns skip even the embedding.
+EXACT_CACHE_MAX_ENTRIES = 2048
+_exact_cache: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+
+
+def _canonical_query(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).strip().lower()
+
+
+def _exact_cache_put(key: str, value) -> None:
+    _exact_cache[key] = value
+    _exact_cache.move_to_end(key)
+    if len(_exact_cache) > EXACT_CACHE_MAX_ENTRIES:
+        _exact_cache.popitem(last=False)
+
+# The cache is optional: fail fast on an unreachable Redis and back off before reconnecting
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "1.0"))
+REDIS_RETRY_AFTER = float(os.getenv("REDIS_RETRY_AFTER", "30"))
+
+_redis = None
+_redis_disabled = False
+_redis_retry_at = 0.0
+
+async def get_redis():
+    """Return a cached redis.asyncio client with the cache index created, or None if not configured/unavailable."""
+    global _redis, _redis_disabled, _redis_retry_at
+    if _redis is not None or not REDIS_URL or _redis_disabled:
+        return _redis
+    if time.monotonic() < _redis_retry_at:
+        return None
+
+    import redis.asyncio as aioredis
+    from redis.exceptions import ResponseError
+    from redis.commands.search.field import VectorField
+    try:
+        from redis.commands.search.index_definition import IndexDefinition, IndexType
+    except ImportError:  # redis-py < 6
+        from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+    client = aioredis.from_url(REDIS_URL, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT)
+    try:
+        await client.ft(SEMANTIC_CACHE_INDEX).create_index(
+            [VectorField("vec", "FLAT", {"TYPE": "FLOAT32", "DIM": EMBEDDING_DIM, "DISTANCE_METRIC": "COSINE"})],
+            definition=IndexDefinition(prefix=[SEMANTIC_CACHE_PREFIX], index_type=IndexType.HASH),
+        )
+    except ResponseError as e:
+        # Index already created by another worker / a previous run
+        if "already exists" not in str(e).lower():
+            # e.g. "unknown command" on plain Redis without RediSearch: turn the layer off once
+            await client.aclose()
+            _redis_disabled = True
+            logger.warning("Redis semantic cache disabled (needs RediSearch): %s", e)
+            return None
+    except Exception as e:
+        # Connection errors etc.: don't leak the pool; requests skip Redis until the retry window passes
+        await client.aclose()
+        _redis_retry_at = time.monotonic() + REDIS_RETRY_AFTER
+        logger.warning("Redis semantic cache unavailable, retrying in %ss: %s", REDIS_RETRY_AFTER, e)
+        return None
+    except BaseException:
+        await client.aclose()
+        raise
+    _redis = client
+    return _redis
+
+
+async def _semantic_cache_lookup(client, vec: np.ndarray):
+    from redis.commands.search.query import Query
+
+    query = (
+        Query("*=>[KNN 1 @vec $vec AS dist]")
+        .return_fields("dist", "value")
+        .dialect(2)
+    )
+    res = await client.ft(SEMANTIC_CACHE_INDEX).search(query, query_params={"vec": vec.tobytes()})
+    if not res.docs:
+        return None
+    # RediSearch COSINE distance is 1 - cosine similarity
+    if 1.0 - float(res.docs[0].dist) < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    return json.loads(res.docs[0].value)
+
+
+async def _semantic_cache_store(client, job_description: str, vec: np.ndarray, value) -> None:
+    key = SEMANTIC_CACHE_PREFIX + hashlib.sha1(job_description.encode("utf-8")).hexdigest()
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping={"vec": vec.tobytes(), "value": json.dumps(value, ensure_ascii=False)})
+        pipe.expire(key, SEMANTIC_CACHE_TTL)
+        await pipe.execute()
+
+
+def semantic_cache(func):
+    """Serve repeated / near-duplicate queries from the caches; cache errors never fail a request."""
+    @functools.wraps(func)
+    async def wrapper(job_description: str):
+        key = _canonical_query(job_description)
+        hit = _exact_cache.get(key)
+        if hit is not None:
+            _exact_cache.move_to_end(key)
+            return _copy_recommendations(hit)
+
+        vec = np.asarray(await embed_query(job_description), dtype=np.float32)
+        vec /= np.linalg.norm(vec) or 1.0
+
+        cached = _local_cache.lookup(vec)
+        if cached is not None:
+            _exact_cache_put(key, cached)
+            return _copy_recommendations(cached)
+
+        client = None
+        if REDIS_URL:
+            try:
+                client = await get_redis()
+                cached = await _semantic_cache_lookup(client, vec) if client is not None else None
+                if cached is not None:
+                    _local_cache.add(vec, cached)
+                    _exact_cache_put(key, cached)
+                    return _copy_recommendations(cached)
+            except Exception as e:
+                logger.warning("Semantic cache lookup failed: %s", e)
+
+        result = await func(job_description, query_vector=vec)
+
+        if result:
+            _exact_cache_put(key, result)
+            _local_cache.add(vec, result)
+            if client is not None:
+                try:
+                    await _semantic_cache_store(client, job_description, vec, result)
+                except Exception as e:
+                    logger.warning("Semantic cache store failed: %s", e)
+        # The caches keep `result`; the caller gets its own copy
+        return _copy_recommendations(result)
+
+    return wrapper
 
 # --------------------------------------------------
 # MAIN RECOMMENDATION FUNCTION (API)
 # --------------------------------------------------
-async def recommend_assessments(job_description: str) -> List[Dict[str, Any]]:
-    retriever = get_retriever()
+@semantic_cache
+async def recommend_assessments(job_description: str, query_vector=None) -> List[Dict[str, Any]]:
+    # The semantic cache passes in the embedding it already computed, so the query is embedded once
+    if query_vector is None:
+        query_vector = await embed_query(job_description)
     # Get the initial candidate set (up to 20) from vector search
-    retrieved_docs = await retriever.ainvoke(job_description)
-
-    # Filter only individual solutions (default to 'individual' when missing)
-    filtered_docs = [d for d in retrieved_docs if d.metadata.get('solution_type', 'individual') == 'individual']
-    if not filtered_docs:
-        # If no docs survived filtering, fall back to original retrieved_docs
-        filtered_docs = retrieved_docs
-
-    blocks = []
-    for i, doc in enumerate(filtered_docs):
-        blocks.append(
-            f"""
-            Assessment {i+1}:
-            Name: {doc.metadata.get('name')}
-            Description: {doc.metadata.get('description')}
-            Test Types: {doc.metadata.get('test_types')}
-            Duration: {doc.metadata.get('duration')}
-            """
-        )
+    retrieved_docs = await _retrieve_candidates(job_description, query_vector)
+    return await _rerank(job_description, retrieved_docs)
 
-    prompt = rerank_prompt.format(
-        query=job_description,
-        assessments="\n".join(blocks),
-    )
+
+# Skip the LLM when the vector ranking is already decisive: cosine gap between
+# the 1st and 5th candidate at least this large. Off by default ("inf") until a
+# margin is validated with evaluation.py against the LLM-reranked recall.
+RERANK_CONFIDENCE_MARGIN = float(os.getenv("RERANK_CONFIDENCE_MARGIN") or "inf")
+
+
+def _confident_vector_order(docs) -> bool:
+    if len(docs) < 5 or any(d.get("_score") is None for d in docs[:5]):
+        return False
+    # Candidates arrive sorted by score, best first
+    return docs[0]["_score"] - docs[4]["_score"] >= RERANK_CONFIDENCE_MARGIN
+
+
+async def _rerank(job_description: str, filtered_docs) -> List[Dict[str, Any]]:
+    """Ask the LLM to pick 5-10 of the retrieved candidates and shape them for the API."""
+    if _confident_vector_order(filtered_docs):
+        return [_api_for(doc) for doc in filtered_docs[:10]]
+
+    prompt = build_rerank_prompt(job_description, filtered_docs)
 
     llm = get_llm()
     response = (await llm.ainvoke(prompt)).content.strip()
 
     try:
-        indices = json.loads(response)
+        indices = json.loads(response)["indices"]
         if not isinstance(indices, list):
-            raise ValueError()
-    except Exception:
-        # Default to top 5 if parser fails
+            raise ValueError("'indices' is not a list")
+    except Exception as e:
+        # JSON mode makes this rare; default to top 5 by vector order
+        logger.warning("Unparseable rerank response %r: %s", response[:200], e)
         indices = list(range(1, min(6, len(filtered_docs) + 1)))
 
     # Normalize indices: unique, valid, and at most 10
@@ -255,35 +792,103 @@ async def recommend_assessments(job_description: str) -> List[Dict[str, Any]]:
     for idx in clean_indices:
         if 1 <= idx <= len(filtered_docs):
             doc = filtered_docs[idx - 1]
-            recommendations.append({
-                # API spec compliance: exact fields and types
-                "name": doc.metadata.get("name", ""),
-                "url": doc.metadata.get("url", ""),
-                "description": doc.metadata.get("description", ""),
-                # Parse duration into integer minutes
-                "duration": parse_duration_minutes(doc.metadata.get("duration", None)),
-                "remote_support": normalize_yes_no(doc.metadata.get("remote_testing_support", doc.metadata.get("remote_support", "No"))),
-                "adaptive_support": normalize_yes_no(doc.metadata.get("adaptive_irt_support", doc.metadata.get("adaptive_support", "No"))),
-                # Convert verbose test type names to letter codes
-                "test_type": map_test_types_to_codes(doc.metadata.get("test_types", [])),
-            })
+            recommendations.append(_api_for(doc))
 
     return recommendations
 
 
+def _copy_recommendations(recs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fresh copies of API records, so callers can't mutate what the caches hold."""
+    return [{**rec, "test_type": list(rec.get("test_type", []))} for rec in recs]
+
+
+def _api_for(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """API record for a candidate, copied off the (cached) candidate payload."""
+    api = doc.get("_api")
+    # Precomputed at ingest; collections built before that fall back to shaping here
+    return _copy_recommendations([api])[0] if api else _api_record(doc)
+
+
+def _api_record(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a catalog entry as an API recommendation (stored in the Qdrant payload at ingest)."""
+    return {
+        # API spec compliance: exact fields and types
+        "name": entry.get("name", ""),
+        "url": entry.get("url", ""),
+        "description": entry.get("description", ""),
+        # Parse duration into integer minutes
+        "duration": parse_duration_minutes(entry.get("duration", None)),
+        "remote_support": normalize_yes_no(entry.get("remote_testing_support", entry.get("remote_support", "No"))),
+        "adaptive_support": normalize_yes_no(entry.get("adaptive_irt_support", entry.get("adaptive_support", "No"))),
+        # Convert verbose test type names to letter codes
+        "test_type": map_test_types_to_codes(entry.get("test_types", [])),
+    }
+
+# --------------------------------------------------
+# BATCH RECOMMENDATION (EVALUATION / PREDICTION RUNS)
+# --------------------------------------------------
+# Cap on in-flight vector searches / LLM calls so large query sets don't flood Qdrant or hit Groq rate limits
+BATCH_CONCURRENCY = 16
+
+async def iter_recommendations_batch(
+    queries: List[str],
+    raw: bool = False,
+    k: int = 10,
+    concurrency: int = BATCH_CONCURRENCY,
+):
+    """
+    Recommend for many queries at once, yielding each result as soon as it and
+    every earlier query have resolved.
+
+    All queries are embedded in a single model call, then the vector searches
+    (and LLM reranks, unless ``raw``) run concurrently, at most ``concurrency``
+    at a time. Results are yielded in the same order as ``queries``;
+    ``raw=True`` matches recommend_assessments_raw.
+    """
+    if not queries:
+        return
+
+    embeddings = await asyncio.to_thread(get_embedding_model().embed_documents, list(queries))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(query: str, embedding: List[float]):
+        async with sem:
+            docs = await _retrieve_candidates(query, embedding)
+            if raw:
+                return _raw_urls(docs, k)
+            return await _rerank(query, docs)
+
+    tasks = [asyncio.ensure_future(one(q, e)) for q, e in zip(queries, embeddings)]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # Consumer stopped early or a query failed: don't leave searches running
+        for task in tasks:
+            task.cancel()
+
+
+async def recommend_assessments_batch(
+    queries: List[str],
+    raw: bool = False,
+    k: int = 10,
+    concurrency: int = BATCH_CONCURRENCY,
+):
+    """All results of iter_recommendations_batch as a list, in the order of ``queries``."""
+    return [recs async for recs in iter_recommendations_batch(queries, raw=raw, k=k, concurrency=concurrency)]
+
+
+_DURATION_RE = re.compile(r"(\d+)")
+
 def parse_duration_minutes(duration_field: str) -> int:
     """Parse duration string like '49 minutes' into integer minutes. Return 0 if not parsable."""
     if not duration_field:
         return 0
     if isinstance(duration_field, int):
         return duration_field
-    try:
-        import re
-        m = re.search(r"(\d+)", str(duration_field))
-        if m:
-            return int(m.group(1))
-    except Exception:
-        pass
+    m = _DURATION_RE.search(str(duration_field))
+    if m:
+        return int(m.group(1))
     return 0
 
 
@@ -296,36 +901,57 @@ def normalize_yes_no(val: str) -> str:
     return "No"
 
 
+# Lower-cased test type name -> letter code; already-single-letter entries map to themselves
+_CODE_LUT: Dict[str, str] = {
+    "ability": "A",
+    "behavioral": "B",
+    "cognitive": "C",
+    "knowledge": "K",
+    "personality": "P",
+    "situational": "S",
+}
+_CODE_LUT.update({code.lower(): code for code in "ABCKPS"})
+
+
 def map_test_types_to_codes(types) -> List[str]:
     """Map verbose test types to letter codes expected by the spec."""
     if not types:
         return []
-    reverse_map = {
-        "Ability": "A",
-        "Behavioral": "B",
-        "Cognitive": "C",
-        "Knowledge": "K",
-        "Personality": "P",
-        "Situational": "S",
-        # Accept already-single-letter entries
-        "A": "A",
-        "B": "B",
-        "C": "C",
-        "K": "K",
-        "P": "P",
-        "S": "S",
-    }
-    codes = []
-    for t in types:
-        t_str = str(t).strip()
-        code = reverse_map.get(t_str)
-        if not code:
-            # Try capitalized first letter fallback
-            t_up = t_str.title()
-            code = reverse_map.get(t_up)
-        if code and code not in codes:
-            codes.append(code)
-    return codes
+    # dict.fromkeys dedups while keeping first-seen order
+    codes = (_CODE_LUT.get(str(t).strip().lower()) for t in types)
+    return list(dict.fromkeys(c for c in codes if c))
+
+# --------------------------------------------------
+# WARMUP (CALLED FROM THE API STARTUP HOOK)
+# --------------------------------------------------
+def _warm_embeddings():
+    get_embedding_model().embed_query("warmup")
+
+
+async def _warm_llm():
+    # Best-effort: opens the TLS connection to Groq ahead of the first rerank. Reranking
+    # is optional at serve time (and often skipped), so this never affects readiness.
+    try:
+        llm = await asyncio.to_thread(get_llm)
+        # JSON mode requires the prompt to mention JSON; no max_tokens cap, since Groq
+        # rejects a truncated JSON-mode reply
+        await llm.ainvoke("Reply with an empty JSON object.")
+    except Exception as e:
+        logger.warning("LLM warmup skipped: %s", e)
+
+
+_llm_warm_task = None
+
+
+async def warmup():
+    """Load the embedding model and open the Qdrant client/collection concurrently; the LLM ping runs in the background."""
+    global _llm_warm_task
+    if _llm_warm_task is None:
+        _llm_warm_task = asyncio.create_task(_warm_llm())
+    await asyncio.gather(
+        asyncio.to_thread(_warm_embeddings),
+        asyncio.to_thread(get_retriever),
+    )
 
 # --------------------------------------------------
 # LOCAL TEST
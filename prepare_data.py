@@ -1,30 +1,32 @@
+import orjson
 import pandas as pd
-import json
 
-# Load Excel
-xls = pd.ExcelFile("Gen_AI Dataset.xlsx")
+# Load Excel with the Rust calamine reader (pandas >= 2.2) instead of pure-Python openpyxl;
+# the workbook is opened once and both sheets are read from it
+xls = pd.ExcelFile("Gen_AI Dataset.xlsx", engine="calamine")
 
 # ---------- TRAIN ----------
-train_df = pd.read_excel(xls, "Train-Set")
+train_df = pd.read_excel(xls, "Train-Set", dtype_backend="pyarrow")
 
-train_data = []
-for query, group in train_df.groupby("Query"):
-    train_data.append({
-        "query": query,
-        "relevant_urls": group["Assessment_url"].dropna().tolist()
-    })
+# One vectorized groupby-agg instead of a Python loop over groups
+agg = (
+    train_df.dropna(subset=["Assessment_url"])
+    .groupby("Query", as_index=False)["Assessment_url"]
+    .agg(list)
+)
+train_data = agg.rename(columns={"Query": "query", "Assessment_url": "relevant_urls"}).to_dict("records")
 
-with open("train.json", "w", encoding="utf-8") as f:
-    json.dump(train_data, f, indent=2)
+with open("train.json", "wb") as f:
+    f.write(orjson.dumps(train_data, option=orjson.OPT_INDENT_2))
 
 print(f"Saved train.json with {len(train_data)} queries")
 
 # ---------- TEST ----------
-test_df = pd.read_excel(xls, "Test-Set")
+test_df = pd.read_excel(xls, "Test-Set", dtype_backend="pyarrow")
 
 test_data = [{"query": q} for q in test_df["Query"].dropna().tolist()]
 
-with open("test.json", "w", encoding="utf-8") as f:
-    json.dump(test_data, f, indent=2)
+with open("test.json", "wb") as f:
+    f.write(orjson.dumps(test_data, option=orjson.OPT_INDENT_2))
 
 print(f"Saved test.json with {len(test_data)} queries")
@@ -0,0 +1,43 @@
+"""
+One-time export of all-MiniLM-L6-v2 to ONNX with dynamic int8 quantization.
+
+main.get_embedding_model() picks the result up from ONNX_MODEL_DIR
+(default: models/all-MiniLM-L6-v2-onnx-int8) and serves it with ONNX Runtime
+instead of PyTorch.
+
+Usage (from the repo root):
+    pip install "optimum[onnxruntime]"
+    python scripts/export_minilm.py [output_dir]
+"""
+import os
+import sys
+import tempfile
+
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_OUTPUT_DIR = os.getenv("ONNX_MODEL_DIR", "models/all-MiniLM-L6-v2-onnx-int8")
+
+
+def export(output_dir: str) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as fp32_dir:
+        # fp32 ONNX graph first, then quantize weights to int8 (activations quantized at runtime)
+        model = ORTModelForFeatureExtraction.from_pretrained(MODEL_ID, export=True)
+        model.save_pretrained(fp32_dir)
+
+        quantizer = ORTQuantizer.from_pretrained(fp32_dir)
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=True)
+        quantizer.quantize(save_dir=output_dir, quantization_config=qconfig)  # -> model_quantized.onnx
+
+    # tokenizer.json is all the runtime needs (loaded with the `tokenizers` package)
+    AutoTokenizer.from_pretrained(MODEL_ID).save_pretrained(output_dir)
+
+    print(f"Saved int8 ONNX model and tokenizer to {output_dir}")
+
+
+if __name__ == "__main__":
+    export(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_OUTPUT_DIR)
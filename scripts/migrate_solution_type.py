@@ -0,0 +1,46 @@
+"""
+One-time migration: back-fill 'solution_type' (default 'individual') on every
+entry of the SHL catalogue JSON.
+
+main.py assumes every entry already carries the field and no longer patches
+the file at import time; run this after scraping a fresh catalogue.
+
+Usage (from the repo root):
+    python scripts/migrate_solution_type.py [shl_file]
+"""
+import json
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_SHL_FILE = "shl_assessments.json"
+
+
+def migrate(path: str) -> int:
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+    updated = 0
+    for entry in data:
+        if "solution_type" not in entry:
+            entry["solution_type"] = "individual"
+            updated += 1
+
+    # Only rewrite the file when something actually changed
+    if updated:
+        if orjson is not None:
+            with open(path, "wb") as wf:
+                wf.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(path, "w", encoding="utf-8") as wf:
+                json.dump(data, wf, indent=2, ensure_ascii=False)
+    return updated
+
+
+if __name__ == "__main__":
+    shl_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SHL_FILE
+    print(f"Added solution_type to {migrate(shl_file)} entries in {shl_file}")